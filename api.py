@@ -0,0 +1,377 @@
+"""本地 HTTP 批处理接口
+
+与 Streamlit 界面共用 workers 中的工作池和结果缓存。接口说明：
+
+    POST /jobs                 multipart 上传，字段 files（可多个PDF，文件名不可重复）、case_type、agent_fee、
+                               manual_categories（可选，JSON：{"申请人": {"商标名称": "9,35"}}），返回任务ID
+    GET  /jobs/<id>            任务状态及排队位置
+    GET  /jobs/<id>/results    NDJSON 流，每处理完一个文件输出一行，最后一行为 done 事件
+    GET  /jobs/<id>/download   下载生成的请款单和发票申请表（ZIP）
+    DELETE /jobs/<id>          删除任务及其临时文件；未结束的任务会被取消，结果流以 status 为 cancelled 的 done 事件结束
+
+未提供类别的待手动输入商标不会计入请款单，处理时输出 warning 事件，并在 done 事件的 omitted 中列出。
+已结束的任务超过 BILLING_API_JOB_TTL_HOURS 小时后，在创建新任务时连同临时文件一起清理。
+
+可单独运行 `python api.py --port 8502`，也会在 Streamlit 应用启动时随进程一同启动。
+"""
+import os
+import json
+import uuid
+import shutil
+import zipfile
+import argparse
+import tempfile
+import time
+import threading
+import traceback
+from concurrent.futures import as_completed
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import billing
+import workers
+
+CASE_TYPES = ("新申请商标", "案件类商标")
+# 已结束任务的保留时间（小时）
+JOB_TTL_HOURS = float(os.environ.get("BILLING_API_JOB_TTL_HOURS", 24))
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_server = None
+_server_lock = threading.Lock()
+
+class Job:
+    def __init__(self, case_type, agent_fee, manual_categories=None):
+        self.id = uuid.uuid4().hex
+        # 每个任务在调度器中作为独立会话参与公平排队
+        self.session_id = f"api-{self.id}"
+        self.case_type = case_type
+        self.agent_fee = agent_fee
+        # 与界面相同的键格式，见 billing.manual_category_key
+        self.manual_categories = manual_categories or {}
+        self.work_dir = tempfile.mkdtemp(prefix=f"billing-job-{self.id[:8]}-")
+        self.pdf_dir = os.path.join(self.work_dir, "pdf_files")
+        self.output_dir = os.path.join(self.work_dir, "output")
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.filenames = []
+        self.events = []
+        self.status = "running"
+        self.outputs = []
+        self.archive_path = None
+        self.omitted = []
+        self.finished_at = None
+        # 由 discard_job 设置，任务线程据此停止处理且不再生成文件
+        self.cancelled = False
+        self.cond = threading.Condition()
+
+    def add_file(self, filename, payload):
+        with open(os.path.join(self.pdf_dir, filename), "wb") as f:
+            f.write(payload)
+        self.filenames.append(filename)
+
+    def emit(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def describe(self):
+        with self.cond:
+            finished = sum(1 for e in self.events if e["event"] == "file")
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "case_type": self.case_type,
+                "total": len(self.filenames),
+                "finished": finished,
+                "outputs": list(self.outputs),
+                "queue": workers.queue_status(self.session_id),
+            }
+
+    def run(self):
+        extracted_data = []
+        try:
+            futures = {
+                workers.submit(os.path.join(self.pdf_dir, name), self.case_type, name, session_id=self.session_id): name
+                for name in self.filenames
+            }
+            for future in as_completed(futures):
+                if self.cancelled:
+                    break
+                filename = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    self.emit({"event": "file", "file": filename, "status": "error", "error": str(e)})
+                    continue
+                extracted_data.append(data)
+                self.emit({"event": "file", "file": filename, "status": "ok", "data": data})
+
+            if self.cancelled:
+                # 取消可能发生在提交过程中，再撤回一次之后才进入队列的文件
+                workers.cancel_session(self.session_id)
+                self.status = "cancelled"
+            else:
+                self._generate(extracted_data)
+                self.status = "cancelled" if self.cancelled else "done"
+        except Exception as e:
+            if self.cancelled:
+                # 临时目录已被删除，生成过程中的报错不再上报
+                self.status = "cancelled"
+            else:
+                self.status = "error"
+                self.emit({"event": "error", "error": str(e), "traceback": traceback.format_exc()})
+        self.finished_at = time.time()
+        self.emit({"event": "done", "status": self.status, "outputs": list(self.outputs),
+                   "omitted": list(self.omitted),
+                   "download": f"/jobs/{self.id}/download" if self.archive_path and not self.cancelled else None})
+
+    def _report_omitted(self, extracted_data):
+        """未提供类别的待手动输入商标不会计费，逐个输出 warning 事件"""
+        if self.case_type != "新申请商标":
+            return
+        for data in extracted_data:
+            for tm in data["商标列表"]:
+                key = billing.manual_category_key(data["申请人"], tm["商标名称"])
+                if tm["类别"] == "MANUAL_INPUT_REQUIRED" and not self.manual_categories.get(key, "").strip():
+                    item = {"file": data["文件名"], "applicant": data["申请人"], "商标名称": tm["商标名称"]}
+                    self.omitted.append(item)
+                    self.emit({"event": "warning", **item,
+                               "warning": "商标未找到自动关联的类别且未提供 manual_categories，未计入请款单"})
+
+    def _generate(self, extracted_data):
+        self._report_omitted(extracted_data)
+        pending = []
+        for applicant, records in billing.group_by_applicant(extracted_data, self.case_type).items():
+            processed_records = billing.billing_records(
+                applicant, records, extracted_data, self.case_type, self.agent_fee, self.manual_categories
+            )
+            if processed_records:
+                future = workers.submit_call(
+                    billing.create_word_doc, applicant, processed_records, self.output_dir, self.case_type,
+                    session_id=self.session_id,
+                )
+                pending.append((applicant, processed_records, future))
+
+        excel_rows = []
+        for applicant, processed_records, future in pending:
+            try:
+                self.outputs.append(future.result())
+                excel_rows.append(billing.summary_row(applicant, processed_records))
+            except Exception as e:
+                self.emit({"event": "error", "applicant": applicant, "error": f"生成请款单时出错: {e}"})
+
+        if excel_rows:
+            self.outputs.append(
+                workers.submit_call(billing.build_excel, excel_rows, self.output_dir, session_id=self.session_id).result()
+            )
+
+        if self.outputs:
+            self.archive_path = os.path.join(self.work_dir, "outputs.zip")
+            with zipfile.ZipFile(self.archive_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for name in self.outputs:
+                    zf.write(os.path.join(self.output_dir, name), arcname=name)
+
+def create_job(case_type, agent_fee, files, manual_categories=None):
+    """创建批处理任务并在后台线程中运行，files 为 (文件名, 内容) 列表"""
+    purge_expired_jobs()
+    job = Job(case_type, agent_fee, manual_categories)
+    for filename, payload in files:
+        job.add_file(filename, payload)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    threading.Thread(target=job.run, name=f"billing-job-{job.id[:8]}", daemon=True).start()
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def discard_job(job_id):
+    with _jobs_lock:
+        job = _jobs.pop(job_id, None)
+    if job:
+        job.cancelled = True
+        workers.cancel_session(job.session_id)
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+    return job
+
+def purge_expired_jobs(ttl_hours=JOB_TTL_HOURS):
+    """清理结束时间超过保留期限的任务"""
+    cutoff = time.time() - ttl_hours * 3600
+    with _jobs_lock:
+        expired = [job_id for job_id, job in _jobs.items() if job.finished_at and job.finished_at < cutoff]
+    for job_id in expired:
+        discard_job(job_id)
+    return len(expired)
+
+def parse_manual_categories(raw):
+    """把 {"申请人": {"商标名称": "9,35"}} 转换为 billing.manual_category_key 格式的映射"""
+    if not raw:
+        return {}
+    value = json.loads(raw)
+    if not isinstance(value, dict) or not all(isinstance(v, dict) for v in value.values()):
+        raise ValueError("manual_categories 格式应为 {申请人: {商标名称: 类别}}")
+    return {
+        billing.manual_category_key(applicant, tm_name): str(categories)
+        for applicant, trademarks in value.items()
+        for tm_name, categories in trademarks.items()
+    }
+
+def parse_multipart(content_type, body):
+    """解析 multipart/form-data，返回 (普通字段字典, [(文件名, 内容)])"""
+    msg = BytesParser(policy=default_policy).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    fields, files = {}, []
+    if not msg.is_multipart():
+        return fields, files
+    for part in msg.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename:
+            files.append((os.path.basename(filename), payload))
+        elif name:
+            fields[name] = payload.decode("utf-8").strip()
+    return fields, files
+
+class BillingRequestHandler(BaseHTTPRequestHandler):
+    server_version = "BillingAPI/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "not found"})
+
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            return self._send_json(400, {"error": "需要 multipart/form-data 上传"})
+
+        length = int(self.headers.get("Content-Length") or 0)
+        fields, files = parse_multipart(content_type, self.rfile.read(length))
+        files = [(name, payload) for name, payload in files if name.lower().endswith(".pdf")]
+        if not files:
+            return self._send_json(400, {"error": "未上传PDF文件"})
+        names = [name for name, _ in files]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            return self._send_json(400, {"error": "上传的文件名重复", "files": duplicates})
+
+        case_type = fields.get("case_type", "新申请商标")
+        if case_type not in CASE_TYPES:
+            return self._send_json(400, {"error": f"不支持的案件类型: {case_type}"})
+        try:
+            agent_fee = int(fields.get("agent_fee", billing.DEFAULT_AGENT_FEE))
+        except ValueError:
+            return self._send_json(400, {"error": "agent_fee 必须为整数"})
+        try:
+            manual_categories = parse_manual_categories(fields.get("manual_categories"))
+        except ValueError as e:
+            return self._send_json(400, {"error": f"manual_categories 无效: {e}"})
+
+        job = create_job(case_type, agent_fee, files, manual_categories)
+        self._send_json(202, {
+            "job_id": job.id,
+            "files": len(files),
+            "status": f"/jobs/{job.id}",
+            "results": f"/jobs/{job.id}/results",
+            "download": f"/jobs/{job.id}/download",
+        })
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+        if len(parts) < 2 or parts[0] != "jobs" or len(parts) > 3:
+            return self._send_json(404, {"error": "not found"})
+        job = get_job(parts[1])
+        if job is None:
+            return self._send_json(404, {"error": "任务不存在"})
+
+        action = parts[2] if len(parts) == 3 else ""
+        if action == "":
+            self._send_json(200, job.describe())
+        elif action == "results":
+            self._stream_results(job)
+        elif action == "download":
+            self._send_archive(job)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+        if len(parts) != 2 or parts[0] != "jobs" or discard_job(parts[1]) is None:
+            return self._send_json(404, {"error": "任务不存在"})
+        self._send_json(200, {"job_id": parts[1], "status": "deleted"})
+
+    def _stream_results(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        sent = 0
+        while True:
+            with job.cond:
+                while sent >= len(job.events):
+                    job.cond.wait()
+                pending = job.events[sent:]
+            sent += len(pending)
+            for event in pending:
+                self.wfile.write(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+            if pending[-1]["event"] == "done":
+                return
+
+    def _send_archive(self, job):
+        if job.status == "running":
+            return self._send_json(409, {"error": "任务尚未完成", **job.describe()})
+        if not job.archive_path:
+            return self._send_json(404, {"error": "没有可下载的文件", **job.describe()})
+
+        with open(job.archive_path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="billing-{job.id}.zip"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_server(host="127.0.0.1", port=8502):
+    """在后台线程中启动 HTTP 服务；同一进程内重复调用只启动一次"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), BillingRequestHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="billing-api", daemon=True).start()
+        return _server
+
+def main():
+    parser = argparse.ArgumentParser(description="商标案件请款系统本地 HTTP 批处理接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), BillingRequestHandler)
+    server.daemon_threads = True
+    print(f"Billing API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,27 @@
 import os
-import re
-import datetime
-import pdfplumber
-import streamlit as st
-from docx import Document
-from openpyxl import load_workbook
-from collections import defaultdict
-import tempfile
+import uuid
+from concurrent.futures import FIRST_COMPLETED, wait
 import traceback
 import shutil
-from pathlib import Path
+import streamlit as st
+
+import workers
+from checkpoint import BatchJournal
+from billing import (
+    PAYMENT_TEMPLATE,
+    INVOICE_TEMPLATE,
+    DEFAULT_AGENT_FEE,
+    group_by_applicant,
+    billing_records,
+    summary_row,
+    manual_category_key,
+    create_word_doc,
+    build_excel,
+)
+
+# 本地 HTTP 批处理接口端口，设为 0 时不启动
+API_HOST = os.environ.get("BILLING_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("BILLING_API_PORT", "8502"))
 
 # 设置页面标题和布局
 st.set_page_config(page_title="商标案件请款系统", layout="wide")
@@ -29,352 +41,146 @@ if 'generated_files' not in st.session_state:
     st.session_state.generated_files = []
 if 'temp_dir' not in st.session_state:
     st.session_state.temp_dir = ""
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # 在共享调度器中标识本会话
+if 'journal' not in st.session_state:
+    st.session_state.journal = None  # 当前批次的检查点日志
 
-# 官费标准
-OFFICIAL_FEES = {
-    "驳回复审": 675,
-    "商标异议": 450,
-    "撤三申请": 450,
-    "无效宣告": 750,
-    "新申请商标": 270,  # 新申请商标的官费
-}
+# ============================= 进程级资源 =============================
+# 以下函数经 st.cache_resource 缓存，每个服务进程只执行一次，脚本重跑时直接复用
+@st.cache_resource
+def check_templates():
+    """检查模板文件是否存在"""
+    return os.path.exists(PAYMENT_TEMPLATE), os.path.exists(INVOICE_TEMPLATE)
 
-# 金额转大写函数
-CN_NUM = ['零', '壹', '贰', '叁', '肆', '伍', '陆', '柒', '捌', '玖']
-CN_UNIT = ['', '拾', '佰', '仟', '万', '拾', '佰', '仟', '亿']
+@st.cache_resource
+def start_api_server(host, port):
+    """随 Streamlit 服务进程启动一次本地 HTTP 批处理接口，端口被占用时返回 None"""
+    import api
+    
+    try:
+        return api.start_server(host, port)
+    except OSError:
+        return None
 
-def number_to_upper(amount):
-    s = str(int(amount))
-    result = []
-    for i, ch in enumerate(s[::-1]):
-        if int(ch) != 0:
-            result.append(f"{CN_NUM[int(ch)]}{CN_UNIT[i]}")
-    return ''.join(reversed(result)) + "元整"
+@st.cache_resource
+def prewarm_workers():
+    """在后台预热工作进程，不阻塞页面渲染"""
+    return workers.prewarm()
 
-# ============================= 新申请商标处理函数 =============================
-def extract_pdf_data(pdf_path):
-    """从新申请PDF提取数据"""
-    applicant = "N/A"
-    unified_credit_code = "N/A"
-    final_date = "N/A"
-    trademarks_with_categories = []
-    pending_categories = []
-    
-    with pdfplumber.open(pdf_path) as pdf:
-        all_texts = [page.extract_text().replace("　", " ").replace("\xa0", " ").strip() 
-                     if page.extract_text() else "" for page in pdf.pages]
-        all_text_combined = "\n---PAGE_BREAK---\n".join(all_texts)
-        pages = all_text_combined.split("\n---PAGE_BREAK---\n")
-        
-        for page_num, page_text in enumerate(pages):
-            # 第一页：提取申请人和统一社会信用代码
-            if page_num == 0:
-                applicant_match = re.search(r"申请人名称\(中文\)：\s*(.*?)\s*\(\s*英文\)", page_text)
-                applicant = applicant_match.group(1).strip() if applicant_match else "N/A"
-                
-                # 使用统一的信用代码提取正则表达式
-                unified_credit_code_match = re.search(r'(?:统一社会信用代码|信用代码)[：:]\s*([0-9A-Z]{18})', page_text, re.IGNORECASE)
-                unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
-                
-                # 尝试从第一页提取日期
-                if final_date == "N/A":
-                    date_match = re.search(r"(\d{4}年\s*\d{1,2}月\s*\d{1,2}日)", page_text)
-                    final_date = date_match.group(1).replace(" ", "") if date_match else "N/A"
-                continue
-            
-            # 后续页面：提取类别或商标名
-            # 检查是否包含类别信息
-            if re.search(r'类别：\d+', page_text):
-                categories_found = re.findall(r'类别：(\d+)', page_text)
-                pending_categories.extend(categories_found)
+# ============================= 排队状态 =============================
+def wait_with_queue_status(futures):
+    """逐个返回已完成的任务，等待期间显示本会话的排队位置和预计等待时间"""
+    status_box = st.empty()
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            yield from done
             
-            # 检查是否包含委托书
-            elif '商 标 代 理 委 托 书' in page_text:
-                tm_name_match = re.search(r'商标代理委托书.*?代理\s+(.*?)商标\s*的\s*如下.*?事宜', 
-                                         page_text, re.DOTALL)
-                tm_name = tm_name_match.group(1).strip() if tm_name_match else ""
-                
-                if not tm_name:
-                    fallback_match = re.search(r'代理\s+(.*?)\s*商标', page_text)
-                    tm_name = fallback_match.group(1).strip() if fallback_match else ""
-                
-                if not tm_name:
-                    st.warning(f"警告：在文件 {os.path.basename(pdf_path)} 的第 {page_num + 1} 页委托书中未找到商标名称。")
-                
-                # 提取委托书日期
-                date_match = re.search(r"(\d{4}年\s*\d{1,2}月\s*\d{1,2}日)", page_text)
-                if date_match:
-                    final_date = date_match.group(1).replace(" ", "")
-                
-                # 关联类别与商标名
-                if pending_categories:
-                    for category in pending_categories:
-                        trademarks_with_categories.append({
-                            "商标名称": tm_name,
-                            "类别": category
-                        })
-                    pending_categories.clear()
+            if pending:
+                status = workers.queue_status(st.session_state.session_id)
+                finished = len(futures) - len(pending)
+                if status["queued"]:
+                    status_box.info(
+                        f"排队中：前方还有 {status['sessions_ahead']} 个用户的任务，"
+                        f"本批已完成 {finished}/{len(futures)}，预计剩余约 {status['eta_seconds']:.0f} 秒"
+                    )
                 else:
-                    trademarks_with_categories.append({
-                        "商标名称": tm_name,
-                        "类别": "MANUAL_INPUT_REQUIRED"
-                    })
-                    st.warning(f"提示：文件 {os.path.basename(pdf_path)} 中的商标 '{tm_name}' 未找到自动关联的类别，需要手动输入。")
-        
-        # 检查是否还有未关联的类别
-        if pending_categories:
-            st.warning(f"警告：文件 {os.path.basename(pdf_path)} 处理完毕，但仍有未关联的类别 {pending_categories}。这些类别将被忽略。")
-    
-    return {
-        "申请人": applicant,
-        "统一社会信用代码": unified_credit_code,
-        "日期": final_date,
-        "商标列表": trademarks_with_categories,
-        "事宜类型": "商标注册申请"
-    }
+                    status_box.info(f"处理中：本批已完成 {finished}/{len(futures)}，预计剩余约 {status['eta_seconds']:.0f} 秒")
+    finally:
+        # 页面中断或重跑时撤回本会话仍在排队的任务
+        workers.cancel_session(st.session_state.session_id)
+        status_box.empty()
 
-# ============================= 案件类商标处理函数 =============================
-def extract_case_info(text, filename):
-    if any(kw in filename for kw in ['驳回', '复审']):
-        return extract_review_case(text, filename)
-    elif any(kw in filename for kw in ['撤三', '撤销连续']):
-        return extract_non_use_case(text, filename)
-    elif '异议' in filename:
-        return extract_opposition_case(text, filename)
-    elif any(kw in filename for kw in ['无效', '宣告']):
-        return extract_invalid_case(text, filename)
-    else:
-        raise ValueError(f"无法识别案件类型: {filename}")
+# ============================= 批次检查点 =============================
+def sync_from_journal(journal):
+    """用检查点日志中的提取结果重建会话中的提取数据和申请人聚合"""
+    st.session_state.extracted_data = list(journal.extracted_data)
+    st.session_state.applicant_map = group_by_applicant(journal.extracted_data, journal.case_type)
+    st.session_state.processing_stage = 1 if journal.extracted_data else 0
 
-def extract_review_case(text, filename):
-    case_type = "驳回复审"
-    applicant = re.search(r'(?:申请人名称\$\$中文\$\$|申请人名称)：\s*([^\n]*?)(?=\s+(?:统一社会信用代码|地址))', 
-                          text, re.DOTALL)
-    applicant = applicant.group(1).strip() if applicant else "N/A"
-    
-    # 提取统一社会信用代码
-    unified_credit_code_match = re.search(r'(?:统一社会信用代码|信用代码)[：:]\s*([0-9A-Z]{18})', text, re.IGNORECASE)
-    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
-    
-    trademarks = []
-    for m in re.finditer(r'申请商标：\s*(.*?)\s+类别：\s*(\d+).*?申请号/国际注册号：\s*([0-9A-Za-z]+)', 
-                         text, re.DOTALL):
-        trademarks.append({
-            "商标名称": m.group(1).strip(), 
-            "类别": int(m.group(2)), 
-            "注册号": m.group(3)
-        })
-    
-    return {
-        "文件名": filename, 
-        "案件类型": case_type, 
-        "申请人": applicant,
-        "统一社会信用代码": unified_credit_code,
-        "商标列表": trademarks
-    }
+def reset_batch_inputs(agent_fees=None, manual_categories=None):
+    """清掉上一个批次留下的代理费和手动类别输入，换成指定批次的值
 
-def extract_non_use_case(text, filename):
-    case_type = "撤三申请"
-    applicant = re.search(r'(?:申请人名称|申请人)：\s*([^\n]*?)(?=\s+(?:统一社会信用代码|地址))', 
-                          text, re.DOTALL)
-    applicant = applicant.group(1).strip() if applicant else "N/A"
-    
-    # 提取统一社会信用代码
-    unified_credit_code_match = re.search(r'(?:统一社会信用代码|信用代码)[：:]\s*([0-9A-Z]{18})', text, re.IGNORECASE)
-    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
-    
-    trademarks = []
-    trademark_name_match = re.search(r'商标：\s*(.*?)\s*(?=\n|$)', text)
-    category_match = re.search(r'类别：\s*(\d+)', text)
-    registration_number_match = re.search(r'商标注册号：\s*([0-9A-Za-z]+)', text)
-    
-    if trademark_name_match and category_match and registration_number_match:
-        trademarks.append({
-            "商标名称": trademark_name_match.group(1).strip(),
-            "类别": int(category_match.group(1)),
-            "注册号": registration_number_match.group(1)
-        })
-   
-    return {
-        "文件名": filename, 
-        "案件类型": case_type, 
-        "申请人": applicant,
-        "统一社会信用代码": unified_credit_code,
-        "商标列表": trademarks
-    }
+    带 key 的输入框会忽略 value 参数，不清掉的话同名申请人的输入框会沿用旧值并写回新批次。
+    """
+    for key in list(st.session_state.keys()):
+        if key.startswith(("fee_", "manual_")):
+            del st.session_state[key]
+    st.session_state.agent_fees = dict(agent_fees or {})
+    for key, value in (manual_categories or {}).items():
+        st.session_state[key] = value
 
-def extract_opposition_case(text, filename):
-    case_type = "商标异议"
-    applicant = re.search(r'异议人名称：\s*([^\n]*?)\s+统一社会信用代码', 
-                          text, re.IGNORECASE)
-    applicant = applicant.group(1).strip() if applicant else "N/A"
-    
-    # 提取统一社会信用代码
-    unified_credit_code_match = re.search(r'(?:统一社会信用代码|信用代码)[：:]\s*([0-9A-Z]{18})', text, re.IGNORECASE)
-    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
-    
-    trademarks = []
-    for m in re.finditer(r'被异议商标：\s*(.*?)\s+被异议类别：\s*(\d+).*?商标注册号：\s*([0-9A-Za-z]+)', 
-                         text, re.DOTALL):
-        trademarks.append({
-            "商标名称": m.group(1).strip(), 
-            "类别": int(m.group(2)), 
-            "注册号": m.group(3)
-        })
-    
-    return {
-        "文件名": filename, 
-        "案件类型": case_type, 
-        "申请人": applicant,
-        "统一社会信用代码": unified_credit_code,
-        "商标列表": trademarks
-    }
+def restore_batch(journal):
+    """从检查点恢复整个批次，包括用户填写的代理费和手动类别"""
+    st.session_state.journal = journal
+    st.session_state.case_type = journal.case_type
+    st.session_state.temp_dir = journal.dir
+    reset_batch_inputs(journal.agent_fees, journal.manual_categories)
+    sync_from_journal(journal)
 
-def extract_invalid_case(text, filename):
-    case_type = "无效宣告"
-    applicant = re.search(r'(?:申请人名称\$\$中文\$\$|申请人名称)：\s*([^\n]*?)(?=\s+(?:统一社会信用代码|地址))', 
-                          text, re.DOTALL)
-    applicant = applicant.group(1).strip() if applicant else "N/A"
+def extract_files(journal, filenames):
+    """提取批次中的文件，每完成一个就写入检查点"""
+    case_type = journal.case_type
     
-    # 提取统一社会信用代码
-    unified_credit_code_match = re.search(r'(?:统一社会信用代码|信用代码)[：:]\s*([0-9A-Z]{18})', text, re.IGNORECASE)
-    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
-    
-    trademarks = []
-    for m in re.finditer(r'争议商标：\s*(.*?)\s+类别：\s*(\d+).*?注册号/国际注册号：\s*([0-9A-Za-z]+)', 
-                         text, re.DOTALL):
-        trademarks.append({
-            "商标名称": m.group(1).strip(), 
-            "类别": int(m.group(2)), 
-            "注册号": m.group(3)
-        })
-    
-    return {
-        "文件名": filename, 
-        "案件类型": case_type, 
-        "申请人": applicant,
-        "统一社会信用代码": unified_credit_code,
-        "商标列表": trademarks
+    # 提交到共享调度器，与其他会话及本地 HTTP 接口公平分享处理能力
+    futures = {
+        workers.submit(os.path.join(journal.pdf_dir, filename), case_type, filename,
+                       session_id=st.session_state.session_id): filename
+        for filename in filenames
     }
-
-# ============================= 通用文档生成函数 =============================
-def create_word_doc(applicant, records, output_dir, case_type):
-    """生成Word请款单"""
-    # 使用后台模板文件
-    template_path = "请款单模板.docx"
-    
-    if not os.path.exists(template_path):
-        st.error(f"错误: 找不到请款单模板文件 '{template_path}'")
-        return None
     
-    try:
-        doc = Document(template_path)
-        
-        # 计算汇总
-        if case_type == "新申请商标":
-            case_types = ["商标注册申请"]
-        else:
-            case_types = list({r["案件类型"] for r in records})
-        
-        case_type_str = "、".join(case_types)
-        total_official = sum(r["官费"] for r in records)
-        total_agent = sum(r["代理费"] for r in records)
-        total = total_official + total_agent
-        
-        # 替换正文占位符
-        today_str = datetime.date.today().strftime("%Y年%m月%d日")
-        for para in doc.paragraphs:
-            for run in para.runs:
-                run.text = run.text.replace("{申请人}", applicant) \
-                                  .replace("{事宜类型}", case_type_str) \
-                                  .replace("{日期}", today_str) \
-                                  .replace("{总官费}", str(total_official)) \
-                                  .replace("{总代理费}", str(total_agent)) \
-                                  .replace("{总计}", str(total)) \
-                                  .replace("{大写}", number_to_upper(total))
-        
-        # 动态写入表格
-        if doc.tables:
-            table = doc.tables[0]
+    for future in wait_with_queue_status(futures):
+        filename = futures[future]
+        try:
+            data = future.result()
+            applicant = data["申请人"]
             
-            # 删除模板中的示例行（如果存在）
-            if len(table.rows) > 1:
-                for _ in range(len(table.rows) - 1, 0, -1):
-                    table._tbl.remove(table.rows[1]._tr)
+            for warning in data.get("警告", []):
+                st.warning(warning)
             
-            # 添加数据行
-            for idx, rec in enumerate(records, 1):
-                row = table.add_row().cells
-                row[0].text = str(idx)
-                row[1].text = rec["案件类型"] if case_type != "新申请商标" else "商标注册申请"
-                row[2].text = rec["商标名称"]
-                row[3].text = str(rec["类别"])
-                row[4].text = f"{rec['官费']}"
-                row[5].text = f"{rec['代理费']}"
-                row[6].text = f"{rec['官费'] + rec['代理费']}"
+            journal.record_file(data)
             
-            # 追加合计行
-            total_row = table.add_row().cells
-            total_row[0].merge(total_row[3])
-            total_row[0].text = "合计"
-            total_row[4].text = f"{total_official}"
-            total_row[5].text = f"{total_agent}"
-            total_row[6].text = f"{total}"
-        
-        # 保存文件
-        filename = f"请款单（{applicant}-{case_type_str}）-{total}-{datetime.date.today().strftime('%Y%m%d')}.docx"
-        output_path = os.path.join(output_dir, filename)
-        doc.save(output_path)
-        
-        return filename
-    except Exception as e:
-        st.error(f"生成Word文档时出错: {str(e)}")
-        st.text(traceback.format_exc())
-        return None
-
-def build_excel(rows, output_dir):
-    """生成Excel汇总表"""
-    # 使用后台模板文件
-    template_path = "发票申请表.xlsx"
+            if case_type == "新申请商标":
+                st.success(f"成功处理: {filename} (申请人: {applicant})")
+            else:
+                st.success(f"成功处理: {filename} (申请人: {applicant}, 类型: {data['案件类型']})")
+                
+        except Exception as e:
+            st.error(f"处理文件 {filename} 时出错: {str(e)}")
+            st.text(traceback.format_exc())
     
-    if not os.path.exists(template_path):
-        st.error(f"错误: 找不到发票申请表模板文件 '{template_path}'")
-        return None
+    # 保存处理结果到session
+    sync_from_journal(journal)
     
-    try:
-        wb = load_workbook(template_path)
-        ws = wb.active
-        row_idx = 2
-        
-        for r in rows:
-            ws[f"C{row_idx}"] = r["申请人"]
-            ws[f"D{row_idx}"] = r["统一社会信用代码"]  # 统一社会信用代码列
-            ws[f"G{row_idx}"] = r["总官费"]
-            ws[f"H{row_idx}"] = r["总官费"]
-            ws[f"I{row_idx}"] = r["总计"]
-            ws[f"Q{row_idx}"] = datetime.date.today().strftime("%Y年%m月%d日")
-            row_idx += 1
-            
-            ws[f"C{row_idx}"] = r["申请人"]
-            ws[f"D{row_idx}"] = r["统一社会信用代码"]  # 统一社会信用代码列
-            ws[f"G{row_idx}"] = r["总代理费"]
-            ws[f"H{row_idx}"] = r["总代理费"]
-            ws[f"I{row_idx}"] = r["总计"]
-            ws[f"Q{row_idx}"] = datetime.date.today().strftime("%Y年%m月%d日")
-            row_idx += 1
-        
-        excel_name = f"发票申请表-{datetime.date.today().strftime('%Y%m%d')}.xlsx"
-        excel_path = os.path.join(output_dir, excel_name)
-        wb.save(excel_path)
-        
-        return excel_name
-    except Exception as e:
-        st.error(f"生成Excel汇总时出错: {str(e)}")
-        st.text(traceback.format_exc())
-        return None
+    st.success(f"成功处理 {len(filenames)} 个PDF文件！")
+    st.info(f"共发现 {len(st.session_state.applicant_map)} 个申请人")
 
 # ============================= 主应用逻辑 =============================
 def main_app():
+    # 页面重新加载时按地址中的批次ID恢复
+    batch_id = st.query_params.get("batch")
+    journal = st.session_state.journal
+    if batch_id and (journal is None or journal.batch_id != batch_id):
+        journal = BatchJournal.open(batch_id)
+        if journal:
+            restore_batch(journal)
+            st.info(f"已恢复批次 {batch_id}：已完成 {len(journal.extracted_data)} 个文件")
+        else:
+            st.warning(f"未找到批次 {batch_id} 的检查点")
+            del st.query_params["batch"]
+    
+    with st.sidebar:
+        st.header("批次检查点")
+        if st.session_state.journal:
+            st.caption("当前批次ID（刷新页面或重新打开后可凭此恢复）")
+            st.code(st.session_state.journal.batch_id)
+        resume_id = st.text_input("恢复批次", placeholder="输入批次ID")
+        if resume_id and st.button("恢复"):
+            st.query_params["batch"] = resume_id.strip()
+            st.rerun()
+    
     # 案件类型选择
     st.header("1. 选择案件类型")
     st.session_state.case_type = st.radio(
@@ -392,99 +198,35 @@ def main_app():
     if uploaded_files and st.button("处理PDF文件"):
         with st.spinner("正在处理PDF文件..."):
             try:
-                # 创建临时目录
-                temp_dir = tempfile.mkdtemp()
-                st.session_state.temp_dir = temp_dir
-                
-                pdf_dir = os.path.join(temp_dir, "pdf_files")
-                output_dir = os.path.join(temp_dir, "output")
-                os.makedirs(pdf_dir, exist_ok=True)
-                os.makedirs(output_dir, exist_ok=True)
-                
-                # 保存上传的文件
+                # 新建批次检查点，上传的文件保存在批次目录中
+                journal = BatchJournal.create(case_type)
                 for uploaded_file in uploaded_files:
-                    file_path = os.path.join(pdf_dir, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                
-                # 按申请人聚合
-                applicant_map = defaultdict(list)
-                extracted_data = []
-                
-                for filename in os.listdir(pdf_dir):
-                    if filename.endswith(".pdf"):
-                        try:
-                            file_path = os.path.join(pdf_dir, filename)
-                            
-                            if case_type == "新申请商标":
-                                # 新申请商标处理
-                                data = extract_pdf_data(file_path)
-                                applicant = data["申请人"]
-                                unified_credit_code = data["统一社会信用代码"]
-                                
-                                for tm in data["商标列表"]:
-                                    # 处理需要手动输入的类别
-                                    if tm["类别"] == "MANUAL_INPUT_REQUIRED":
-                                        # 在后续步骤中处理
-                                        continue
-                                    
-                                    applicant_map[applicant].append({
-                                        "商标名称": tm["商标名称"],
-                                        "类别": tm["类别"],
-                                        "案件类型": "商标注册申请",
-                                        "官费": OFFICIAL_FEES["新申请商标"],
-                                        "统一社会信用代码": unified_credit_code,  # 添加统一社会信用代码
-                                    })
-                                
-                                extracted_data.append(data)
-                                st.success(f"成功处理: {filename} (申请人: {applicant})")
-                            
-                            else:
-                                # 案件类商标处理
-                                with pdfplumber.open(file_path) as pdf:
-                                    text = []
-                                    for page in pdf.pages:
-                                        txt = page.extract_text()
-                                        if not txt:
-                                            continue
-                                        if any(k in txt for k in ["申请书", "申 请 书", "撤销", "异议", "无效", "宣告"]):
-                                            txt = txt.replace("　", " ").replace("\xa0", " ")
-                                            txt = re.sub(r'[\u3000]', ' ', txt)
-                                            text.append(txt)
-                                    text = "".join(text).strip()
-                                
-                                # 提取案件信息
-                                data = extract_case_info(text, filename)
-                                applicant = data["申请人"]
-                                unified_credit_code = data["统一社会信用代码"]
-                                
-                                for tm in data["商标列表"]:
-                                    applicant_map[applicant].append({
-                                        "商标名称": tm["商标名称"],
-                                        "类别": tm["类别"],
-                                        "案件类型": data["案件类型"],
-                                        "官费": OFFICIAL_FEES[data["案件类型"]],
-                                        "统一社会信用代码": unified_credit_code,  # 添加统一社会信用代码
-                                    })
-                                
-                                extracted_data.append(data)
-                                st.success(f"成功处理: {filename} (申请人: {applicant}, 类型: {data['案件类型']})")
-                                
-                        except Exception as e:
-                            st.error(f"处理文件 {filename} 时出错: {str(e)}")
-                            st.text(traceback.format_exc())
+                    journal.save_upload(uploaded_file.name, uploaded_file.getbuffer())
                 
-                # 保存处理结果到session
-                st.session_state.extracted_data = extracted_data
-                st.session_state.applicant_map = dict(applicant_map)
-                st.session_state.processing_stage = 1
+                st.session_state.journal = journal
+                st.session_state.temp_dir = journal.dir
+                reset_batch_inputs()
+                st.query_params["batch"] = journal.batch_id
                 
-                st.success(f"成功处理 {len(uploaded_files)} 个PDF文件！")
-                st.info(f"共发现 {len(applicant_map)} 个申请人")
+                extract_files(journal, journal.pending_files())
                 
             except Exception as e:
                 st.error(f"处理过程中发生错误: {str(e)}")
                 st.text(traceback.format_exc())
+    
+    # 恢复的批次中还有未完成的文件
+    journal = st.session_state.journal
+    if journal and st.session_state.processing_stage < 2:
+        pending_files = journal.pending_files()
+        if pending_files:
+            st.info(f"批次 {journal.batch_id} 中还有 {len(pending_files)} 个文件尚未处理完成")
+            if st.button("继续处理剩余文件"):
+                with st.spinner("正在处理PDF文件..."):
+                    try:
+                        extract_files(journal, pending_files)
+                    except Exception as e:
+                        st.error(f"处理过程中发生错误: {str(e)}")
+                        st.text(traceback.format_exc())
 
     # 显示提取结果
     if st.session_state.processing_stage >= 1 and st.session_state.extracted_data:
@@ -492,7 +234,7 @@ def main_app():
         
         for applicant, records in st.session_state.applicant_map.items():
             with st.expander(f"申请人: {applicant}"):
-                st.write(f"统一社会信用代码: {records[0].get('统一社会信用代码', 'N/A')}")
+                st.write(f"统一社会信用代码: {records[0].get('统一社会信用代码', 'N/A') if records else 'N/A'}")
                 st.write(f"案件数量: {len(records)}")
                 for record in records:
                     st.write(f"- 商标: {record['商标名称']}, 类别: {record['类别']}, 类型: {record['案件类型']}, 官费: {record['官费']}元")
@@ -512,7 +254,7 @@ def main_app():
         # 设置代理费
         st.subheader("代理费设置")
         for applicant in st.session_state.applicant_map.keys():
-            default_fee = st.session_state.agent_fees.get(applicant, 600)
+            default_fee = st.session_state.agent_fees.get(applicant, DEFAULT_AGENT_FEE)
             fee = st.number_input(
                 f"{applicant}的代理费(元/件)", 
                 min_value=0, 
@@ -520,6 +262,8 @@ def main_app():
                 key=f"fee_{applicant}"
             )
             st.session_state.agent_fees[applicant] = fee
+            if st.session_state.journal:
+                st.session_state.journal.record_agent_fee(applicant, fee)
         
         # 新申请商标需要手动输入类别
         if case_type == "新申请商标":
@@ -528,7 +272,7 @@ def main_app():
                 applicant = data["申请人"]
                 for tm in data["商标列表"]:
                     if tm["类别"] == "MANUAL_INPUT_REQUIRED":
-                        key = f"manual_{applicant}_{tm['商标名称']}"
+                        key = manual_category_key(applicant, tm["商标名称"])
                         categories = st.text_input(
                             f"商标 '{tm['商标名称']}' 的类别(多个类别用逗号分隔)", 
                             key=key,
@@ -538,6 +282,9 @@ def main_app():
                         # 保存手动输入的类别
                         if categories:
                             st.session_state[key] = categories
+                        # 清空输入也要记录，否则恢复时会带回旧值
+                        if st.session_state.journal:
+                            st.session_state.journal.record_manual_category(key, categories)
 
     # 生成文档按钮
     if st.session_state.processing_stage >= 1 and st.session_state.applicant_map and st.button("生成请款单"):
@@ -549,83 +296,57 @@ def main_app():
                 generated_files = []
                 excel_rows = []
                 
+                # Word文档生成同样交给共享调度器
+                word_futures = {}
                 for applicant, records in st.session_state.applicant_map.items():
                     try:
                         # 添加代理费到记录
                         agent_fee = st.session_state.agent_fees.get(applicant, 1000)
                         
                         # 对于新申请商标，添加手动输入的类别
-                        if st.session_state.case_type == "新申请商标":
-                            # 创建一个新的记录列表，处理手动输入
-                            processed_records = []
-                            unified_credit_code = records[0].get("统一社会信用代码", "N/A")
-                            
-                            for data in st.session_state.extracted_data:
-                                if data["申请人"] == applicant:
-                                    for tm in data["商标列表"]:
-                                        if tm["类别"] == "MANUAL_INPUT_REQUIRED":
-                                            key = f"manual_{applicant}_{tm['商标名称']}"
-                                            categories_input = st.session_state.get(key, "")
-                                            if categories_input:
-                                                categories = [cat.strip() for cat in categories_input.split(",") if cat.strip()]
-                                                for cat in categories:
-                                                    processed_records.append({
-                                                        "商标名称": tm["商标名称"],
-                                                        "类别": cat,
-                                                        "案件类型": "商标注册申请",
-                                                        "官费": OFFICIAL_FEES["新申请商标"],
-                                                        "代理费": agent_fee,
-                                                        "统一社会信用代码": unified_credit_code,
-                                                    })
-                                        else:
-                                            processed_records.append({
-                                                "商标名称": tm["商标名称"],
-                                                "类别": tm["类别"],
-                                                "案件类型": "商标注册申请",
-                                                "官费": OFFICIAL_FEES["新申请商标"],
-                                                "代理费": agent_fee,
-                                                "统一社会信用代码": unified_credit_code,
-                                            })
-                        else:
-                            # 案件类商标直接添加代理费
-                            processed_records = []
-                            unified_credit_code = records[0].get("统一社会信用代码", "N/A")
-                            
-                            for record in records:
-                                record["代理费"] = agent_fee
-                                record["统一社会信用代码"] = unified_credit_code
-                                processed_records.append(record)
+                        processed_records = billing_records(
+                            applicant,
+                            records,
+                            st.session_state.extracted_data,
+                            st.session_state.case_type,
+                            agent_fee,
+                            st.session_state,
+                        )
                         
-                        # 生成Word文档
                         if processed_records:
-                            word_filename = create_word_doc(
+                            future = workers.submit_call(
+                                create_word_doc,
                                 applicant, 
                                 processed_records, 
                                 output_dir,
-                                st.session_state.case_type
+                                st.session_state.case_type,
+                                session_id=st.session_state.session_id,
                             )
-                            
-                            if word_filename:
-                                word_path = os.path.join(output_dir, word_filename)
-                                with open(word_path, "rb") as f:
-                                    word_data = f.read()
-                                
-                                generated_files.append({
-                                    "name": word_filename,
-                                    "data": word_data,
-                                    "type": "word"
-                                })
-                                
-                                # 收集汇总数据
-                                total_official = sum(r["官费"] for r in processed_records)
-                                total_agent = sum(r["代理费"] for r in processed_records)
-                                excel_rows.append({
-                                    "申请人": applicant,
-                                    "统一社会信用代码": unified_credit_code,  # 添加统一社会信用代码
-                                    "总官费": total_official,
-                                    "总代理费": total_agent,
-                                    "总计": total_official + total_agent,
-                                })
+                            word_futures[future] = (applicant, processed_records)
+                    
+                    except Exception as e:
+                        st.error(f"为申请人 '{applicant}' 生成请款单时出错: {str(e)}")
+                        st.text(traceback.format_exc())
+                
+                # 等待全部完成后按申请人顺序收集结果
+                for _ in wait_with_queue_status(word_futures):
+                    pass
+                
+                for future, (applicant, processed_records) in word_futures.items():
+                    try:
+                        word_filename = future.result()
+                        word_path = os.path.join(output_dir, word_filename)
+                        with open(word_path, "rb") as f:
+                            word_data = f.read()
+                        
+                        generated_files.append({
+                            "name": word_filename,
+                            "data": word_data,
+                            "type": "word"
+                        })
+                        
+                        # 收集汇总数据
+                        excel_rows.append(summary_row(applicant, processed_records))
                     
                     except Exception as e:
                         st.error(f"为申请人 '{applicant}' 生成请款单时出错: {str(e)}")
@@ -633,8 +354,10 @@ def main_app():
                 
                 # 生成Excel汇总
                 if excel_rows:
-                    excel_filename = build_excel(excel_rows, output_dir)
-                    if excel_filename:
+                    try:
+                        excel_filename = workers.submit_call(
+                            build_excel, excel_rows, output_dir, session_id=st.session_state.session_id
+                        ).result()
                         excel_path = os.path.join(output_dir, excel_filename)
                         with open(excel_path, "rb") as f:
                             excel_data = f.read()
@@ -644,6 +367,9 @@ def main_app():
                             "data": excel_data,
                             "type": "excel"
                         })
+                    except Exception as e:
+                        st.error(f"生成Excel汇总时出错: {str(e)}")
+                        st.text(traceback.format_exc())
                 
                 # 保存生成的文件到session
                 st.session_state.generated_files = generated_files
@@ -691,7 +417,7 @@ def main_app():
             if key != 'temp_dir' and key != 'case_type':  # 保留temp_dir和case_type
                 del st.session_state[key]
         
-        # 清理临时目录
+        # 清理临时目录（即当前批次的检查点目录）
         if st.session_state.temp_dir and os.path.exists(st.session_state.temp_dir):
             try:
                 shutil.rmtree(st.session_state.temp_dir)
@@ -704,29 +430,37 @@ def main_app():
         st.session_state.agent_fees = {}
         st.session_state.generated_files = []
         st.session_state.temp_dir = ""
+        st.session_state.journal = None
+        st.query_params.clear()
         
         st.success("系统已重置，可以开始新的处理流程！")
 
 # ============================= 应用入口 =============================
 # 显示模板状态
 st.sidebar.header("系统状态")
-payment_template_exists = os.path.exists("请款单模板.docx")
-invoice_template_exists = os.path.exists("发票申请表.xlsx")
+payment_template_exists, invoice_template_exists = check_templates()
 
 if payment_template_exists and invoice_template_exists:
     st.sidebar.success("✅ 模板文件已就绪")
-    st.sidebar.info("请款单模板: 请款单模板.docx")
-    st.sidebar.info("发票申请表模板: 发票申请表.xlsx")
+    st.sidebar.info(f"请款单模板: {PAYMENT_TEMPLATE}")
+    st.sidebar.info(f"发票申请表模板: {INVOICE_TEMPLATE}")
+    
+    if API_PORT:
+        if start_api_server(API_HOST, API_PORT):
+            st.sidebar.info(f"本地批处理接口: http://{API_HOST}:{API_PORT}")
+        else:
+            st.sidebar.warning(f"本地批处理接口端口 {API_PORT} 已被占用，未启动")
+    prewarm_workers()
     main_app()
 else:
     st.sidebar.error("⚠️ 模板文件缺失")
     if not payment_template_exists:
-        st.sidebar.error("请款单模板 '请款单模板.docx' 不存在")
+        st.sidebar.error(f"请款单模板 '{PAYMENT_TEMPLATE}' 不存在")
     if not invoice_template_exists:
-        st.sidebar.error("发票申请表模板 '发票申请表.xlsx' 不存在")
+        st.sidebar.error(f"发票申请表模板 '{INVOICE_TEMPLATE}' 不存在")
     
     st.error("系统无法启动，因为缺少必要的模板文件。请确保以下文件与应用程序在同一目录下:")
-    st.error("- 请款单模板.docx")
-    st.error("- 发票申请表.xlsx")
+    st.error(f"- {PAYMENT_TEMPLATE}")
+    st.error(f"- {INVOICE_TEMPLATE}")
     
     st.info("请上传模板文件后重新启动应用程序")
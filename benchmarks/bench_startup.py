@@ -0,0 +1,82 @@
+"""启动耗时基准测试
+
+每项测量都在全新的 Python 进程中进行，以反映部署后冷启动的真实开销。
+app.py 通过 streamlit.testing 的 AppTest 执行，分别测量首次运行和之后每次重跑的耗时：
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_TEST = "from streamlit.testing.v1 import AppTest; at = AppTest.from_file('app.py', default_timeout=120)"
+
+# 名称 -> (准备语句, 计时语句)，均在同一个子进程中执行，只对计时语句计时
+CASES = {
+    "应用模块 (billing, workers, api)": ("", "import billing, workers, api"),
+    "streamlit": ("", "import streamlit"),
+    "延迟导入的依赖 (pdfplumber, docx, openpyxl)": ("", "import pdfplumber, docx, openpyxl"),
+    "app.py 首次运行（冷启动）": (APP_TEST, "at.run()"),
+    "app.py 重跑（点击一次的开销）": (APP_TEST + "; at.run()", "at.run()"),
+    "工作进程预热": ("import workers", "[f.result() for f in workers.prewarm()]"),
+}
+
+TIMER = """
+import time
+{setup}
+_t = time.perf_counter()
+{stmt}
+print(time.perf_counter() - _t)
+"""
+
+class MissingModule(Exception):
+    pass
+
+def measure(setup, stmt):
+    """在新进程中执行语句，返回耗时（秒）
+
+    缺少第三方模块时抛出 MissingModule，其他错误原样输出子进程的报错信息。
+    """
+    env = dict(os.environ, BILLING_API_PORT="0")  # 测量时不启动本地 HTTP 接口
+    proc = subprocess.run(
+        [sys.executable, "-c", TIMER.format(setup=setup, stmt=stmt)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        missing = re.search(r"ModuleNotFoundError: No module named '([^']+)'", proc.stderr)
+        if missing:
+            raise MissingModule(missing.group(1))
+        raise RuntimeError(proc.stderr.strip())
+    return float(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="测量应用冷启动各阶段耗时")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复测量的次数")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"Python {sys.version.split()[0]}，每项重复 {args.repeat} 次，取中位数")
+    for name, (setup, stmt) in CASES.items():
+        start = time.perf_counter()
+        try:
+            samples = [measure(setup, stmt) for _ in range(args.repeat)]
+        except MissingModule as e:
+            print(f"{name:<48} 跳过（缺少模块 {e}）")
+            continue
+        except RuntimeError as e:
+            failed = True
+            print(f"{name:<48} 失败")
+            print(e, file=sys.stderr)
+            continue
+        median = statistics.median(samples)
+        print(f"{name:<48} {median * 1000:8.1f} ms  (总耗时 {time.perf_counter() - start:.1f} s)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
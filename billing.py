@@ -0,0 +1,502 @@
+"""请款系统的提取与文档生成逻辑，供 Streamlit 界面、工作进程和本地 HTTP 服务共用"""
+import io
+import os
+import re
+import datetime
+import functools
+
+# pdfplumber、python-docx 和 openpyxl 导入较慢，只在实际用到的函数里导入，
+# 以免打开页面或每次 Streamlit 重跑脚本时都要付出这部分开销
+
+# 官费标准
+OFFICIAL_FEES = {
+    "驳回复审": 675,
+    "商标异议": 450,
+    "撤三申请": 450,
+    "无效宣告": 750,
+    "新申请商标": 270,  # 新申请商标的官费
+}
+
+# 后台模板文件
+PAYMENT_TEMPLATE = "请款单模板.docx"
+INVOICE_TEMPLATE = "发票申请表.xlsx"
+
+# 默认代理费(元/件)
+DEFAULT_AGENT_FEE = 600
+
+# 预编译的正则表达式，模块只在进程内导入一次，所有会话和工作进程共用
+CREDIT_CODE_RE = re.compile(r'(?:统一社会信用代码|信用代码)[：:]\s*([0-9A-Z]{18})', re.IGNORECASE)
+DATE_RE = re.compile(r"(\d{4}年\s*\d{1,2}月\s*\d{1,2}日)")
+FULLWIDTH_SPACE_RE = re.compile(r'[\u3000]')
+
+# 新申请商标
+NEW_APPLICANT_RE = re.compile(r"申请人名称\(中文\)：\s*(.*?)\s*\(\s*英文\)")
+CATEGORY_RE = re.compile(r'类别：(\d+)')
+POA_TM_NAME_RE = re.compile(r'商标代理委托书.*?代理\s+(.*?)商标\s*的\s*如下.*?事宜', re.DOTALL)
+POA_TM_NAME_FALLBACK_RE = re.compile(r'代理\s+(.*?)\s*商标')
+
+# 案件类商标
+APPLICANT_NAME_RE = re.compile(r'(?:申请人名称\$\$中文\$\$|申请人名称)：\s*([^\n]*?)(?=\s+(?:统一社会信用代码|地址))', re.DOTALL)
+REVIEW_TRADEMARK_RE = re.compile(r'申请商标：\s*(.*?)\s+类别：\s*(\d+).*?申请号/国际注册号：\s*([0-9A-Za-z]+)', re.DOTALL)
+NON_USE_APPLICANT_RE = re.compile(r'(?:申请人名称|申请人)：\s*([^\n]*?)(?=\s+(?:统一社会信用代码|地址))', re.DOTALL)
+NON_USE_TM_NAME_RE = re.compile(r'商标：\s*(.*?)\s*(?=\n|$)')
+NON_USE_CATEGORY_RE = re.compile(r'类别：\s*(\d+)')
+NON_USE_REG_NO_RE = re.compile(r'商标注册号：\s*([0-9A-Za-z]+)')
+OPPOSITION_APPLICANT_RE = re.compile(r'异议人名称：\s*([^\n]*?)\s+统一社会信用代码', re.IGNORECASE)
+OPPOSITION_TRADEMARK_RE = re.compile(r'被异议商标：\s*(.*?)\s+被异议类别：\s*(\d+).*?商标注册号：\s*([0-9A-Za-z]+)', re.DOTALL)
+INVALID_TRADEMARK_RE = re.compile(r'争议商标：\s*(.*?)\s+类别：\s*(\d+).*?注册号/国际注册号：\s*([0-9A-Za-z]+)', re.DOTALL)
+
+@functools.lru_cache(maxsize=8)
+def _template_bytes(template_path, mtime):
+    with open(template_path, "rb") as f:
+        return f.read()
+
+def load_template(template_path):
+    """读取模板文件内容并按修改时间缓存，每次生成只需从内存解析"""
+    return io.BytesIO(_template_bytes(template_path, os.path.getmtime(template_path)))
+
+def warm_up():
+    """预先导入重量级依赖并缓存模板，供工作进程启动后提前执行"""
+    import pdfplumber  # noqa: F401
+    import docx  # noqa: F401
+    import openpyxl  # noqa: F401
+    for template_path in (PAYMENT_TEMPLATE, INVOICE_TEMPLATE):
+        if os.path.exists(template_path):
+            load_template(template_path)
+    return os.getpid()
+
+# 金额转大写函数
+CN_NUM = ['零', '壹', '贰', '叁', '肆', '伍', '陆', '柒', '捌', '玖']
+CN_UNIT = ['', '拾', '佰', '仟', '万', '拾', '佰', '仟', '亿']
+
+def number_to_upper(amount):
+    s = str(int(amount))
+    result = []
+    for i, ch in enumerate(s[::-1]):
+        if int(ch) != 0:
+            result.append(f"{CN_NUM[int(ch)]}{CN_UNIT[i]}")
+    return ''.join(reversed(result)) + "元整"
+
+# ============================= 新申请商标处理函数 =============================
+def extract_pdf_data(pdf_path):
+    """从新申请PDF提取数据"""
+    applicant = "N/A"
+    unified_credit_code = "N/A"
+    final_date = "N/A"
+    trademarks_with_categories = []
+    pending_categories = []
+    warnings = []
+    
+    import pdfplumber
+    
+    with pdfplumber.open(pdf_path) as pdf:
+        all_texts = [page.extract_text().replace("　", " ").replace("\xa0", " ").strip() 
+                     if page.extract_text() else "" for page in pdf.pages]
+        all_text_combined = "\n---PAGE_BREAK---\n".join(all_texts)
+        pages = all_text_combined.split("\n---PAGE_BREAK---\n")
+        
+        for page_num, page_text in enumerate(pages):
+            # 第一页：提取申请人和统一社会信用代码
+            if page_num == 0:
+                applicant_match = NEW_APPLICANT_RE.search(page_text)
+                applicant = applicant_match.group(1).strip() if applicant_match else "N/A"
+                
+                # 使用统一的信用代码提取正则表达式
+                unified_credit_code_match = CREDIT_CODE_RE.search(page_text)
+                unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
+                
+                # 尝试从第一页提取日期
+                if final_date == "N/A":
+                    date_match = DATE_RE.search(page_text)
+                    final_date = date_match.group(1).replace(" ", "") if date_match else "N/A"
+                continue
+            
+            # 后续页面：提取类别或商标名
+            # 检查是否包含类别信息
+            if CATEGORY_RE.search(page_text):
+                categories_found = CATEGORY_RE.findall(page_text)
+                pending_categories.extend(categories_found)
+            
+            # 检查是否包含委托书
+            elif '商 标 代 理 委 托 书' in page_text:
+                tm_name_match = POA_TM_NAME_RE.search(page_text)
+                tm_name = tm_name_match.group(1).strip() if tm_name_match else ""
+                
+                if not tm_name:
+                    fallback_match = POA_TM_NAME_FALLBACK_RE.search(page_text)
+                    tm_name = fallback_match.group(1).strip() if fallback_match else ""
+                
+                if not tm_name:
+                    warnings.append(f"警告：在文件 {os.path.basename(pdf_path)} 的第 {page_num + 1} 页委托书中未找到商标名称。")
+                
+                # 提取委托书日期
+                date_match = DATE_RE.search(page_text)
+                if date_match:
+                    final_date = date_match.group(1).replace(" ", "")
+                
+                # 关联类别与商标名
+                if pending_categories:
+                    for category in pending_categories:
+                        trademarks_with_categories.append({
+                            "商标名称": tm_name,
+                            "类别": category
+                        })
+                    pending_categories.clear()
+                else:
+                    trademarks_with_categories.append({
+                        "商标名称": tm_name,
+                        "类别": "MANUAL_INPUT_REQUIRED"
+                    })
+                    warnings.append(f"提示：文件 {os.path.basename(pdf_path)} 中的商标 '{tm_name}' 未找到自动关联的类别，需要手动输入。")
+        
+        # 检查是否还有未关联的类别
+        if pending_categories:
+            warnings.append(f"警告：文件 {os.path.basename(pdf_path)} 处理完毕，但仍有未关联的类别 {pending_categories}。这些类别将被忽略。")
+    
+    return {
+        "申请人": applicant,
+        "统一社会信用代码": unified_credit_code,
+        "日期": final_date,
+        "商标列表": trademarks_with_categories,
+        "事宜类型": "商标注册申请",
+        "警告": warnings
+    }
+
+# ============================= 案件类商标处理函数 =============================
+def extract_case_info(text, filename):
+    if any(kw in filename for kw in ['驳回', '复审']):
+        return extract_review_case(text, filename)
+    elif any(kw in filename for kw in ['撤三', '撤销连续']):
+        return extract_non_use_case(text, filename)
+    elif '异议' in filename:
+        return extract_opposition_case(text, filename)
+    elif any(kw in filename for kw in ['无效', '宣告']):
+        return extract_invalid_case(text, filename)
+    else:
+        raise ValueError(f"无法识别案件类型: {filename}")
+
+def extract_review_case(text, filename):
+    case_type = "驳回复审"
+    applicant = APPLICANT_NAME_RE.search(text)
+    applicant = applicant.group(1).strip() if applicant else "N/A"
+    
+    # 提取统一社会信用代码
+    unified_credit_code_match = CREDIT_CODE_RE.search(text)
+    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
+    
+    trademarks = []
+    for m in REVIEW_TRADEMARK_RE.finditer(text):
+        trademarks.append({
+            "商标名称": m.group(1).strip(), 
+            "类别": int(m.group(2)), 
+            "注册号": m.group(3)
+        })
+    
+    return {
+        "文件名": filename, 
+        "案件类型": case_type, 
+        "申请人": applicant,
+        "统一社会信用代码": unified_credit_code,
+        "商标列表": trademarks
+    }
+
+def extract_non_use_case(text, filename):
+    case_type = "撤三申请"
+    applicant = NON_USE_APPLICANT_RE.search(text)
+    applicant = applicant.group(1).strip() if applicant else "N/A"
+    
+    # 提取统一社会信用代码
+    unified_credit_code_match = CREDIT_CODE_RE.search(text)
+    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
+    
+    trademarks = []
+    trademark_name_match = NON_USE_TM_NAME_RE.search(text)
+    category_match = NON_USE_CATEGORY_RE.search(text)
+    registration_number_match = NON_USE_REG_NO_RE.search(text)
+    
+    if trademark_name_match and category_match and registration_number_match:
+        trademarks.append({
+            "商标名称": trademark_name_match.group(1).strip(),
+            "类别": int(category_match.group(1)),
+            "注册号": registration_number_match.group(1)
+        })
+   
+    return {
+        "文件名": filename, 
+        "案件类型": case_type, 
+        "申请人": applicant,
+        "统一社会信用代码": unified_credit_code,
+        "商标列表": trademarks
+    }
+
+def extract_opposition_case(text, filename):
+    case_type = "商标异议"
+    applicant = OPPOSITION_APPLICANT_RE.search(text)
+    applicant = applicant.group(1).strip() if applicant else "N/A"
+    
+    # 提取统一社会信用代码
+    unified_credit_code_match = CREDIT_CODE_RE.search(text)
+    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
+    
+    trademarks = []
+    for m in OPPOSITION_TRADEMARK_RE.finditer(text):
+        trademarks.append({
+            "商标名称": m.group(1).strip(), 
+            "类别": int(m.group(2)), 
+            "注册号": m.group(3)
+        })
+    
+    return {
+        "文件名": filename, 
+        "案件类型": case_type, 
+        "申请人": applicant,
+        "统一社会信用代码": unified_credit_code,
+        "商标列表": trademarks
+    }
+
+def extract_invalid_case(text, filename):
+    case_type = "无效宣告"
+    applicant = APPLICANT_NAME_RE.search(text)
+    applicant = applicant.group(1).strip() if applicant else "N/A"
+    
+    # 提取统一社会信用代码
+    unified_credit_code_match = CREDIT_CODE_RE.search(text)
+    unified_credit_code = unified_credit_code_match.group(1).strip() if unified_credit_code_match else "N/A"
+    
+    trademarks = []
+    for m in INVALID_TRADEMARK_RE.finditer(text):
+        trademarks.append({
+            "商标名称": m.group(1).strip(), 
+            "类别": int(m.group(2)), 
+            "注册号": m.group(3)
+        })
+    
+    return {
+        "文件名": filename, 
+        "案件类型": case_type, 
+        "申请人": applicant,
+        "统一社会信用代码": unified_credit_code,
+        "商标列表": trademarks
+    }
+
+# ============================= 批处理公共函数 =============================
+def read_case_text(pdf_path):
+    """读取案件类PDF中申请书相关页面的文本"""
+    import pdfplumber
+    
+    with pdfplumber.open(pdf_path) as pdf:
+        text = []
+        for page in pdf.pages:
+            txt = page.extract_text()
+            if not txt:
+                continue
+            if any(k in txt for k in ["申请书", "申 请 书", "撤销", "异议", "无效", "宣告"]):
+                txt = txt.replace("　", " ").replace("\xa0", " ")
+                txt = FULLWIDTH_SPACE_RE.sub(' ', txt)
+                text.append(txt)
+        return "".join(text).strip()
+
+def process_pdf(pdf_path, case_type, filename=None):
+    """按案件类型提取单个PDF，是工作进程中执行的最小任务单元"""
+    filename = filename or os.path.basename(pdf_path)
+    if case_type == "新申请商标":
+        data = extract_pdf_data(pdf_path)
+    else:
+        data = extract_case_info(read_case_text(pdf_path), filename)
+    data["文件名"] = filename
+    return data
+
+def records_from_data(data, case_type):
+    """把单个文件的提取结果转换为按申请人聚合的记录（不含需手动输入类别的商标）"""
+    records = []
+    for tm in data["商标列表"]:
+        if case_type == "新申请商标":
+            # 处理需要手动输入的类别，在后续步骤中处理
+            if tm["类别"] == "MANUAL_INPUT_REQUIRED":
+                continue
+            matter, official_fee = "商标注册申请", OFFICIAL_FEES["新申请商标"]
+        else:
+            matter, official_fee = data["案件类型"], OFFICIAL_FEES[data["案件类型"]]
+        
+        records.append({
+            "商标名称": tm["商标名称"],
+            "类别": tm["类别"],
+            "案件类型": matter,
+            "官费": official_fee,
+            "统一社会信用代码": data["统一社会信用代码"],
+        })
+    return records
+
+def group_by_applicant(extracted_data, case_type):
+    """按申请人聚合记录；没有可计费记录的文件不产生空条目，
+    只有待手动输入类别商标的新申请申请人保留空列表，以便填写类别后生成请款单"""
+    applicant_map = {}
+    for data in extracted_data:
+        records = records_from_data(data, case_type)
+        if records:
+            applicant_map.setdefault(data["申请人"], []).extend(records)
+        elif case_type == "新申请商标" and any(tm["类别"] == "MANUAL_INPUT_REQUIRED" for tm in data["商标列表"]):
+            applicant_map.setdefault(data["申请人"], [])
+    return applicant_map
+
+def manual_category_key(applicant, tm_name):
+    return f"manual_{applicant}_{tm_name}"
+
+def billing_records(applicant, records, extracted_data, case_type, agent_fee, manual_categories):
+    """生成请款单所需的记录，manual_categories 为手动输入类别的映射（键见 manual_category_key）"""
+    processed_records = []
+    if records:
+        unified_credit_code = records[0].get("统一社会信用代码", "N/A")
+    else:
+        # 只有待手动输入类别商标的申请人，从提取结果中取信用代码
+        unified_credit_code = next(
+            (d["统一社会信用代码"] for d in extracted_data if d["申请人"] == applicant), "N/A"
+        )
+    
+    if case_type == "新申请商标":
+        for data in extracted_data:
+            if data["申请人"] != applicant:
+                continue
+            for tm in data["商标列表"]:
+                if tm["类别"] == "MANUAL_INPUT_REQUIRED":
+                    categories_input = manual_categories.get(manual_category_key(applicant, tm["商标名称"]), "")
+                    categories = [cat.strip() for cat in categories_input.split(",") if cat.strip()]
+                else:
+                    categories = [tm["类别"]]
+                
+                for cat in categories:
+                    processed_records.append({
+                        "商标名称": tm["商标名称"],
+                        "类别": cat,
+                        "案件类型": "商标注册申请",
+                        "官费": OFFICIAL_FEES["新申请商标"],
+                        "代理费": agent_fee,
+                        "统一社会信用代码": unified_credit_code,
+                    })
+    else:
+        # 案件类商标直接添加代理费
+        for record in records:
+            processed_records.append(dict(record, 代理费=agent_fee, 统一社会信用代码=unified_credit_code))
+    
+    return processed_records
+
+def summary_row(applicant, processed_records):
+    """汇总表中一个申请人的数据"""
+    total_official = sum(r["官费"] for r in processed_records)
+    total_agent = sum(r["代理费"] for r in processed_records)
+    return {
+        "申请人": applicant,
+        "统一社会信用代码": processed_records[0].get("统一社会信用代码", "N/A"),
+        "总官费": total_official,
+        "总代理费": total_agent,
+        "总计": total_official + total_agent,
+    }
+
+# ============================= 通用文档生成函数 =============================
+def create_word_doc(applicant, records, output_dir, case_type):
+    """生成Word请款单"""
+    # 使用后台模板文件
+    template_path = PAYMENT_TEMPLATE
+    
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"找不到请款单模板文件 '{template_path}'")
+    
+    from docx import Document
+    
+    doc = Document(load_template(template_path))
+
+    # 计算汇总
+    if case_type == "新申请商标":
+        case_types = ["商标注册申请"]
+    else:
+        case_types = list({r["案件类型"] for r in records})
+
+    case_type_str = "、".join(case_types)
+    total_official = sum(r["官费"] for r in records)
+    total_agent = sum(r["代理费"] for r in records)
+    total = total_official + total_agent
+
+    # 替换正文占位符
+    today_str = datetime.date.today().strftime("%Y年%m月%d日")
+    for para in doc.paragraphs:
+        for run in para.runs:
+            run.text = run.text.replace("{申请人}", applicant) \
+                              .replace("{事宜类型}", case_type_str) \
+                              .replace("{日期}", today_str) \
+                              .replace("{总官费}", str(total_official)) \
+                              .replace("{总代理费}", str(total_agent)) \
+                              .replace("{总计}", str(total)) \
+                              .replace("{大写}", number_to_upper(total))
+
+    # 动态写入表格
+    if doc.tables:
+        table = doc.tables[0]
+
+        # 删除模板中的示例行（如果存在）
+        if len(table.rows) > 1:
+            for _ in range(len(table.rows) - 1, 0, -1):
+                table._tbl.remove(table.rows[1]._tr)
+
+        # 添加数据行
+        for idx, rec in enumerate(records, 1):
+            row = table.add_row().cells
+            row[0].text = str(idx)
+            row[1].text = rec["案件类型"] if case_type != "新申请商标" else "商标注册申请"
+            row[2].text = rec["商标名称"]
+            row[3].text = str(rec["类别"])
+            row[4].text = f"{rec['官费']}"
+            row[5].text = f"{rec['代理费']}"
+            row[6].text = f"{rec['官费'] + rec['代理费']}"
+
+        # 追加合计行
+        total_row = table.add_row().cells
+        total_row[0].merge(total_row[3])
+        total_row[0].text = "合计"
+        total_row[4].text = f"{total_official}"
+        total_row[5].text = f"{total_agent}"
+        total_row[6].text = f"{total}"
+
+    # 保存文件
+    filename = f"请款单（{applicant}-{case_type_str}）-{total}-{datetime.date.today().strftime('%Y%m%d')}.docx"
+    output_path = os.path.join(output_dir, filename)
+    doc.save(output_path)
+
+    return filename
+
+def build_excel(rows, output_dir):
+    """生成Excel汇总表"""
+    # 使用后台模板文件
+    template_path = INVOICE_TEMPLATE
+    
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"找不到发票申请表模板文件 '{template_path}'")
+    
+    from openpyxl import load_workbook
+    
+    wb = load_workbook(load_template(template_path))
+    ws = wb.active
+    row_idx = 2
+
+    for r in rows:
+        ws[f"C{row_idx}"] = r["申请人"]
+        ws[f"D{row_idx}"] = r["统一社会信用代码"]  # 统一社会信用代码列
+        ws[f"G{row_idx}"] = r["总官费"]
+        ws[f"H{row_idx}"] = r["总官费"]
+        ws[f"I{row_idx}"] = r["总计"]
+        ws[f"Q{row_idx}"] = datetime.date.today().strftime("%Y年%m月%d日")
+        row_idx += 1
+
+        ws[f"C{row_idx}"] = r["申请人"]
+        ws[f"D{row_idx}"] = r["统一社会信用代码"]  # 统一社会信用代码列
+        ws[f"G{row_idx}"] = r["总代理费"]
+        ws[f"H{row_idx}"] = r["总代理费"]
+        ws[f"I{row_idx}"] = r["总计"]
+        ws[f"Q{row_idx}"] = datetime.date.today().strftime("%Y年%m月%d日")
+        row_idx += 1
+
+    excel_name = f"发票申请表-{datetime.date.today().strftime('%Y%m%d')}.xlsx"
+    excel_path = os.path.join(output_dir, excel_name)
+    wb.save(excel_path)
+
+    return excel_name
+
@@ -0,0 +1,133 @@
+"""批次检查点：把每个文件的提取结果和用户的修改追加写入磁盘日志
+
+浏览器关闭、会话过期或服务重启后，可凭批次ID恢复，已完成的文件不会重新解析。
+每个批次对应一个目录：
+
+    <BILLING_CHECKPOINT_DIR>/<batch_id>/
+        journal.ndjson   追加写入的事件日志
+        pdf_files/       上传的PDF
+        output/          生成的请款单和汇总表
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import tempfile
+
+CHECKPOINT_DIR = os.environ.get(
+    "BILLING_CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "billing-checkpoints")
+)
+# 超过该天数未更新的批次在创建新批次时清理
+CHECKPOINT_TTL_DAYS = float(os.environ.get("BILLING_CHECKPOINT_TTL_DAYS", 7))
+
+_BATCH_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+class BatchJournal:
+    def __init__(self, batch_id, root=CHECKPOINT_DIR):
+        self.batch_id = batch_id
+        self.dir = os.path.join(root, batch_id)
+        self.pdf_dir = os.path.join(self.dir, "pdf_files")
+        self.output_dir = os.path.join(self.dir, "output")
+        self.path = os.path.join(self.dir, "journal.ndjson")
+        self.case_type = None
+        self.extracted_data = []
+        self.agent_fees = {}
+        self.manual_categories = {}
+
+    @classmethod
+    def create(cls, case_type, root=CHECKPOINT_DIR):
+        purge_expired(root)
+        journal = cls(uuid.uuid4().hex, root)
+        os.makedirs(journal.pdf_dir, exist_ok=True)
+        os.makedirs(journal.output_dir, exist_ok=True)
+        journal.case_type = case_type
+        journal._append({"type": "batch", "case_type": case_type, "created": time.time()})
+        return journal
+
+    @classmethod
+    def open(cls, batch_id, root=CHECKPOINT_DIR):
+        """打开已有批次并回放日志，批次不存在或ID不合法时返回 None"""
+        if not batch_id or not _BATCH_ID_RE.fullmatch(batch_id):
+            return None
+        journal = cls(batch_id, root)
+        if not os.path.exists(journal.path):
+            return None
+        journal._replay()
+        return journal
+
+    def _append(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay(self):
+        with open(self.path, "rb+") as f:
+            content = f.read()
+            # 写入过程中断会在末尾留下不完整的一行，截掉以免与后续追加的事件粘连
+            end = content.rfind(b"\n") + 1
+            if end < len(content):
+                f.truncate(end)
+        for line in content[:end].splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(event)
+
+    def _apply(self, event):
+        kind = event.get("type")
+        if kind == "batch":
+            self.case_type = event["case_type"]
+        elif kind == "file":
+            # 同一文件重复记录时以最后一次为准
+            self.extracted_data = [d for d in self.extracted_data if d["文件名"] != event["data"]["文件名"]]
+            self.extracted_data.append(event["data"])
+        elif kind == "agent_fee":
+            self.agent_fees[event["applicant"]] = event["value"]
+        elif kind == "manual_category":
+            self.manual_categories[event["key"]] = event["value"]
+
+    def save_upload(self, filename, payload):
+        with open(os.path.join(self.pdf_dir, filename), "wb") as f:
+            f.write(payload)
+
+    def record_file(self, data):
+        event = {"type": "file", "data": data}
+        self._append(event)
+        self._apply(event)
+
+    def record_agent_fee(self, applicant, value):
+        if self.agent_fees.get(applicant) != value:
+            event = {"type": "agent_fee", "applicant": applicant, "value": value}
+            self._append(event)
+            self._apply(event)
+
+    def record_manual_category(self, key, value):
+        if self.manual_categories.get(key, "") != value:
+            event = {"type": "manual_category", "key": key, "value": value}
+            self._append(event)
+            self._apply(event)
+
+    def done_files(self):
+        return {d["文件名"] for d in self.extracted_data}
+
+    def pending_files(self):
+        """已上传但尚未成功提取的文件"""
+        done = self.done_files()
+        return sorted(
+            name for name in os.listdir(self.pdf_dir)
+            if name.endswith(".pdf") and name not in done
+        )
+
+def purge_expired(root=CHECKPOINT_DIR, ttl_days=CHECKPOINT_TTL_DAYS):
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - ttl_days * 86400
+    for name in os.listdir(root):
+        path = os.path.join(root, name, "journal.ndjson")
+        if _BATCH_ID_RE.fullmatch(name) and os.path.exists(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
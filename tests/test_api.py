@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import api
+import workers
+from workers import Scheduler, _Task
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(workers, "get_executor", lambda: executor)
+    monkeypatch.setattr(workers, "_cache", OrderedDict())
+    sched = Scheduler(max_workers=1, max_inflight_pages=100)
+    monkeypatch.setattr(workers, "_scheduler", sched)
+    yield sched
+    executor.shutdown(wait=True)
+
+def test_discard_running_job_ends_with_cancelled(scheduler, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def extract(name):
+        started.set()
+        assert release.wait(5)
+        return {"文件名": name, "申请人": "甲公司", "商标列表": []}
+
+    def submit(pdf_path, case_type, filename=None, session_id="default"):
+        return scheduler.submit(_Task(extract, (filename,), 1, session_id, key=filename))
+
+    generated = []
+    monkeypatch.setattr(workers, "submit", submit)
+    monkeypatch.setattr(api.Job, "_generate", lambda self, data: generated.append(data))
+
+    job = api.create_job("案件类商标", 600, [(f"{i}.pdf", b"%PDF") for i in range(3)])
+    assert started.wait(5)
+    api.discard_job(job.id)
+    release.set()
+
+    with job.cond:
+        assert job.cond.wait_for(lambda: job.events and job.events[-1]["event"] == "done", timeout=5)
+    assert job.events[-1]["status"] == "cancelled"
+    assert job.events[-1]["download"] is None
+    assert not generated
+    assert api.get_job(job.id) is None
@@ -0,0 +1,58 @@
+import pytest
+
+from checkpoint import BatchJournal
+
+@pytest.fixture
+def journal(tmp_path):
+    return BatchJournal.create("新申请商标", root=str(tmp_path))
+
+def file_data(filename, applicant="甲公司"):
+    return {"文件名": filename, "申请人": applicant, "统一社会信用代码": "N/A", "商标列表": []}
+
+def test_replay_restores_files_and_edits(journal, tmp_path):
+    journal.record_file(file_data("a.pdf"))
+    journal.record_agent_fee("甲公司", 800)
+    journal.record_manual_category("manual_甲公司_A", "9,35")
+
+    restored = BatchJournal.open(journal.batch_id, root=str(tmp_path))
+    assert restored.case_type == "新申请商标"
+    assert restored.done_files() == {"a.pdf"}
+    assert restored.agent_fees == {"甲公司": 800}
+    assert restored.manual_categories == {"manual_甲公司_A": "9,35"}
+
+def test_truncated_last_line_is_dropped(journal, tmp_path):
+    journal.record_file(file_data("a.pdf"))
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"type": "file", "da')
+
+    restored = BatchJournal.open(journal.batch_id, root=str(tmp_path))
+    assert restored.done_files() == {"a.pdf"}
+
+    # 截断后追加的事件不会与残行粘连
+    restored.record_agent_fee("甲公司", 700)
+    assert BatchJournal.open(journal.batch_id, root=str(tmp_path)).agent_fees == {"甲公司": 700}
+
+def test_last_write_wins_per_file(journal, tmp_path):
+    journal.record_file(file_data("a.pdf", applicant="旧申请人"))
+    journal.record_file(file_data("a.pdf", applicant="新申请人"))
+
+    restored = BatchJournal.open(journal.batch_id, root=str(tmp_path))
+    assert [d["申请人"] for d in restored.extracted_data] == ["新申请人"]
+
+def test_cleared_manual_category_is_recorded(journal, tmp_path):
+    journal.record_manual_category("manual_甲公司_A", "9")
+    journal.record_manual_category("manual_甲公司_A", "")
+
+    restored = BatchJournal.open(journal.batch_id, root=str(tmp_path))
+    assert restored.manual_categories == {"manual_甲公司_A": ""}
+
+def test_pending_files_skip_completed(journal):
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        journal.save_upload(name, b"%PDF")
+    journal.record_file(file_data("b.pdf"))
+
+    assert journal.pending_files() == ["a.pdf", "c.pdf"]
+
+@pytest.mark.parametrize("batch_id", ["", "../etc", "0" * 31, "f" * 32])
+def test_open_rejects_invalid_or_unknown_ids(tmp_path, batch_id):
+    assert BatchJournal.open(batch_id, root=str(tmp_path)) is None
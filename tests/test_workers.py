@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pytest
+
+import workers
+from workers import Scheduler, _Task
+
+class Gate:
+    """记录任务开始顺序，任务阻塞到对应的事件被放行"""
+
+    def __init__(self):
+        self.started = []
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def task(self, name, pages=1, session_id=None, key=None):
+        self.events[name] = threading.Event()
+        return _Task(self._run, (name,), pages, session_id or name[0], key)
+
+    def _run(self, name):
+        with self.lock:
+            self.started.append(name)
+        assert self.events[name].wait(5)
+        return name
+
+    def release(self, *names):
+        for name in names or list(self.events):
+            self.events[name].set()
+
+@pytest.fixture
+def gate(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=8)
+    monkeypatch.setattr(workers, "get_executor", lambda: executor)
+    monkeypatch.setattr(workers, "_cache", OrderedDict())
+    g = Gate()
+    yield g
+    g.release()
+    executor.shutdown(wait=True)
+
+def wait_started(gate, count):
+    for _ in range(500):
+        with gate.lock:
+            if len(gate.started) >= count:
+                return list(gate.started)
+        threading.Event().wait(0.01)
+    raise AssertionError(f"只有 {gate.started} 开始运行")
+
+def test_round_robin_between_sessions(gate):
+    scheduler = Scheduler(max_workers=1, max_inflight_pages=100)
+    futures = [scheduler.submit(gate.task("X0"))]
+    for name in ("A1", "A2", "A3", "B1", "B2"):
+        futures.append(scheduler.submit(gate.task(name)))
+
+    wait_started(gate, 1)
+    gate.release()
+    wait(futures, timeout=5)
+    assert gate.started == ["X0", "A1", "B1", "A2", "B2", "A3"]
+
+def test_small_file_skips_blocked_large_file(gate):
+    scheduler = Scheduler(max_workers=4, max_inflight_pages=10)
+    scheduler.submit(gate.task("A1", pages=8))
+    wait_started(gate, 1)
+    large = scheduler.submit(gate.task("B1", pages=8))
+    small = scheduler.submit(gate.task("C1", pages=1))
+
+    assert wait_started(gate, 2) == ["A1", "C1"]
+    assert not large.running()
+
+    gate.release("A1", "C1")
+    assert wait_started(gate, 3) == ["A1", "C1", "B1"]
+    gate.release()
+    assert large.result(timeout=5) == "B1"
+    assert small.result(timeout=5) == "C1"
+
+def test_large_file_is_reserved_after_repeated_bypass(gate, monkeypatch):
+    monkeypatch.setattr(workers, "MAX_BYPASS", 1)
+    scheduler = Scheduler(max_workers=8, max_inflight_pages=10)
+    scheduler.submit(gate.task("A1", pages=5))
+    wait_started(gate, 1)
+    large = scheduler.submit(gate.task("B1", pages=8))
+
+    # 前两个小文件越过大文件，之后为大文件预留页数，后续小文件必须等它先开始
+    scheduler.submit(gate.task("C1", pages=1))
+    scheduler.submit(gate.task("D1", pages=1))
+    late = scheduler.submit(gate.task("E1", pages=1))
+    assert wait_started(gate, 3) == ["A1", "C1", "D1"]
+    assert not late.running()
+
+    gate.release("A1", "C1", "D1")
+    assert wait_started(gate, 5) == ["A1", "C1", "D1", "B1", "E1"]
+    gate.release()
+    assert large.result(timeout=5) == "B1"
+    assert late.result(timeout=5) == "E1"
+
+def test_cancel_session_only_drops_queued_tasks(gate):
+    scheduler = Scheduler(max_workers=1, max_inflight_pages=100)
+    running = scheduler.submit(gate.task("A1"))
+    wait_started(gate, 1)
+    queued = [scheduler.submit(gate.task(name)) for name in ("A2", "A3")]
+    other = scheduler.submit(gate.task("B1"))
+
+    assert scheduler.cancel_session("A") == 2
+    assert all(f.cancelled() for f in queued)
+    # 等待者必须被唤醒，否则 wait()/as_completed() 会一直挂起
+    done, not_done = wait(queued, timeout=1)
+    assert set(done) == set(queued) and not not_done
+    assert scheduler.status("A")["queued"] == 0
+
+    gate.release()
+    assert running.result(timeout=5) == "A1"
+    assert other.result(timeout=5) == "B1"
+    assert "A2" not in gate.started
+
+def test_status_reports_sessions_ahead_and_queue(gate):
+    scheduler = Scheduler(max_workers=1, max_inflight_pages=100)
+    scheduler.submit(gate.task("A1", pages=2))
+    wait_started(gate, 1)
+    scheduler.submit(gate.task("A2", pages=2))
+    scheduler.submit(gate.task("B1", pages=3))
+
+    a, b = scheduler.status("A"), scheduler.status("B")
+    assert (a["sessions_ahead"], a["queued"], a["running"]) == (0, 1, 1)
+    assert (b["sessions_ahead"], b["queued"], b["running"]) == (1, 1, 0)
+    assert a["inflight_pages"] == 2
+    # B 需等待处理中的2页、A2的2页和自身的3页
+    assert b["eta_seconds"] == pytest.approx(7 * workers.DEFAULT_SECONDS_PER_PAGE)
+    c = scheduler.status("C")
+    assert (c["sessions_ahead"], c["queued"], c["running"], c["eta_seconds"]) == (0, 0, 0, 0)
+
+def test_only_extraction_tasks_update_page_estimate(gate):
+    scheduler = Scheduler(max_workers=1, max_inflight_pages=100)
+    generation = gate.task("A1")
+    gate.release("A1")
+    scheduler.submit(generation).result(timeout=5)
+    assert scheduler._seconds_per_page == workers.DEFAULT_SECONDS_PER_PAGE
+
+    extraction = gate.task("B1", key=("digest", "新申请商标", "B1"))
+    gate.release("B1")
+    scheduler.submit(extraction).result(timeout=5)
+    assert scheduler._seconds_per_page < workers.DEFAULT_SECONDS_PER_PAGE
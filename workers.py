@@ -0,0 +1,268 @@
+"""进程级共享的PDF提取调度器
+
+Streamlit 的所有会话与本地 HTTP 服务共用同一个工作池、同一份结果缓存。
+任务按会话分队列，调度时在各会话间轮转（公平排队），并限制同时处理中的总页数，
+避免多个大批量任务同时运行时占满机器。
+"""
+import os
+import copy
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import billing
+
+# 工作进程数量、同时处理的最大页数和结果缓存大小，可通过环境变量调整
+MAX_WORKERS = int(os.environ.get("BILLING_MAX_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+MAX_INFLIGHT_PAGES = int(os.environ.get("BILLING_MAX_INFLIGHT_PAGES", 200))
+CACHE_SIZE = int(os.environ.get("BILLING_CACHE_SIZE", 2048))
+
+# 尚无统计数据时假定的每页处理耗时（秒）
+DEFAULT_SECONDS_PER_PAGE = 0.5
+# 页数放不下的文件最多被其他会话的小文件越过的次数，超过后为它预留页数
+MAX_BYPASS = int(os.environ.get("BILLING_MAX_BYPASS", 4))
+
+_lock = threading.RLock()
+_executor = None
+_cache = OrderedDict()
+
+def get_executor():
+    """返回进程内唯一的工作池（首次调用时创建）"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Streamlit 服务进程本身是多线程的，使用 spawn 避免 fork 带来的锁状态问题
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+def prewarm():
+    """提前启动全部工作进程并导入依赖、缓存模板，避免首个批次承担冷启动开销"""
+    executor = get_executor()
+    return [executor.submit(billing.warm_up) for _ in range(MAX_WORKERS)]
+
+def _reset_executor(broken):
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def count_pages(path):
+    """统计PDF页数，用于准入控制；无法读取时按1页计"""
+    try:
+        import pymupdf
+        with pymupdf.open(path) as doc:
+            return max(1, doc.page_count)
+    except Exception:
+        return 1
+
+def _cache_get(key):
+    with _lock:
+        if key not in _cache:
+            return None
+        _cache.move_to_end(key)
+        return copy.deepcopy(_cache[key])
+
+def _cache_put(key, data):
+    with _lock:
+        _cache[key] = copy.deepcopy(data)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+class _Task:
+    __slots__ = ("fn", "args", "key", "pages", "session_id", "future", "started", "bypassed")
+
+    def __init__(self, fn, args, pages, session_id, key=None):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.pages = pages
+        self.session_id = session_id
+        self.future = Future()
+        self.started = None
+        self.bypassed = 0
+
+class Scheduler:
+    """按会话公平排队的调度器，同时受工作进程数和处理中页数两个上限约束"""
+
+    def __init__(self, max_workers=MAX_WORKERS, max_inflight_pages=MAX_INFLIGHT_PAGES):
+        self.max_workers = max_workers
+        self.max_inflight_pages = max_inflight_pages
+        self._queues = OrderedDict()  # session_id -> deque[_Task]，顺序即轮转顺序
+        self._running = set()
+        self._inflight_pages = 0
+        self._reserved = None  # 已预留页数、等待处理中页数降下来的任务
+        self._seconds_per_page = DEFAULT_SECONDS_PER_PAGE
+
+    def submit(self, task):
+        with _lock:
+            self._queues.setdefault(task.session_id, deque()).append(task)
+        self._dispatch()
+        return task.future
+
+    def cancel_session(self, session_id):
+        """取消某个会话尚在排队的任务（已开始处理的任务不受影响）"""
+        with _lock:
+            queue = self._queues.pop(session_id, deque())
+            if self._reserved is not None and self._reserved.session_id == session_id:
+                self._reserved = None
+        for task in queue:
+            # 只调用 cancel() 不会唤醒 wait()/as_completed() 的等待者，必须再通知一次
+            task.future.cancel()
+            task.future.set_running_or_notify_cancel()
+        return len(queue)
+
+    def _fits(self, pages, reserve=0):
+        # 单个超大文件在空闲时也允许运行，否则永远无法开始
+        return not self._running or self._inflight_pages + pages + reserve <= self.max_inflight_pages
+
+    def _take(self, session_id):
+        queue = self._queues[session_id]
+        task = queue.popleft()
+        # 被选中的会话移到队尾，实现轮转
+        del self._queues[session_id]
+        if queue:
+            self._queues[session_id] = queue
+        return task
+
+    def _next_task(self):
+        """轮转选出下一个可以开始的任务，没有放得下的任务时返回 None
+
+        队首文件页数放不下的会话会被跳过，由后面的会话先处理小文件；
+        同一文件被越过 MAX_BYPASS 次后为它预留页数，其他任务只能使用剩余额度，保证大文件最终能开始。
+        """
+        reserved = self._reserved
+        if reserved is not None and self._fits(reserved.pages):
+            self._reserved = None
+            return self._take(reserved.session_id)
+
+        blocked = []
+        for session_id in list(self._queues):
+            task = self._queues[session_id][0]
+            if task is reserved:
+                continue
+            if self._fits(task.pages, reserved.pages if reserved else 0):
+                for other in blocked:
+                    other.bypassed += 1
+                    if reserved is None and other.bypassed > MAX_BYPASS:
+                        reserved = self._reserved = other
+                return self._take(session_id)
+            blocked.append(task)
+        return None
+
+    def _dispatch(self):
+        failed = []
+        with _lock:
+            while len(self._running) < self.max_workers and self._queues:
+                task = self._next_task()
+                if task is None:
+                    break
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    executor = get_executor()
+                    try:
+                        inner = executor.submit(task.fn, *task.args)
+                    except BrokenProcessPool:
+                        # 工作进程异常退出后重建工作池
+                        _reset_executor(executor)
+                        inner = get_executor().submit(task.fn, *task.args)
+                except Exception as e:
+                    failed.append((task, e))
+                    continue
+                task.started = time.monotonic()
+                self._running.add(task)
+                self._inflight_pages += task.pages
+                inner.add_done_callback(lambda f, task=task: self._finish(task, f))
+        for task, e in failed:
+            task.future.set_exception(e)
+
+    def _finish(self, task, inner):
+        with _lock:
+            self._running.discard(task)
+            self._inflight_pages -= task.pages
+            # 以指数滑动平均估计每页耗时，用于排队时间预估；只统计PDF提取任务
+            if task.key is not None:
+                elapsed = time.monotonic() - task.started
+                self._seconds_per_page = 0.8 * self._seconds_per_page + 0.2 * (elapsed / task.pages)
+
+        exc = inner.exception()
+        if exc is None:
+            result = inner.result()
+            if task.key is not None:
+                _cache_put(task.key, result)
+            task.future.set_result(result)
+        else:
+            task.future.set_exception(exc)
+        self._dispatch()
+
+    def status(self, session_id):
+        """返回会话的排队情况：排在前面的会话数、本会话排队文件数和预计剩余秒数
+
+        sessions_ahead 是轮转顺序中排在本会话之前、仍有排队任务的会话数，
+        即本会话下一个文件开始前还要轮到的其他用户数；会话轮转时该值会变化。
+        """
+        with _lock:
+            sessions = list(self._queues)
+            own = self._queues.get(session_id, ())
+            own_running = [t for t in self._running if t.session_id == session_id]
+            if own:
+                # 轮转调度下，排在本会话之前的每个会话先各处理一个文件
+                ahead = sessions.index(session_id)
+                # 本会话排队任务全部开始前，其余会话至多各处理同样数量的文件
+                pages = sum(t.pages for t in own)
+                for other in sessions:
+                    if other != session_id:
+                        pages += sum(t.pages for t in list(self._queues[other])[:len(own)])
+            else:
+                ahead, pages = 0, 0
+            pages += self._inflight_pages if (own or own_running) else 0
+            eta = pages * self._seconds_per_page / self.max_workers
+            return {
+                "sessions_ahead": ahead,
+                "queued": len(own),
+                "running": len(own_running),
+                "workers": self.max_workers,
+                "inflight_pages": self._inflight_pages,
+                "eta_seconds": round(eta, 1),
+            }
+
+_scheduler = Scheduler()
+
+def submit(pdf_path, case_type, filename=None, session_id="default"):
+    """提交单个PDF的提取任务，返回 Future；内容相同的文件直接命中缓存"""
+    filename = filename or os.path.basename(pdf_path)
+    key = (file_digest(pdf_path), case_type, filename)
+
+    cached = _cache_get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    task = _Task(billing.process_pdf, (pdf_path, case_type, filename), count_pages(pdf_path), session_id, key)
+    return _scheduler.submit(task)
+
+def submit_call(fn, *args, session_id="default", pages=1):
+    """把文档生成等其他CPU密集任务放进同一调度器，pages 为其在准入控制中的权重"""
+    return _scheduler.submit(_Task(fn, args, pages, session_id))
+
+def queue_status(session_id):
+    return _scheduler.status(session_id)
+
+def cancel_session(session_id):
+    return _scheduler.cancel_session(session_id)